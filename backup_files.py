@@ -3,7 +3,7 @@
 # =============================================================================
 # Created:      01-July-2014          -           Revised Date:    24-Jul-2023
 # File:         backup_files.py
-# Depends:      colorama
+# Depends:      colorama, isal (optional)
 # Compat:       3.7+
 # Author:       Cashiuus - Cashiuus{at}gmail
 #
@@ -45,37 +45,69 @@ __author__ = 'Cashiuus'
 import argparse
 import errno
 import fnmatch
+import functools
+import hashlib
+import importlib.util
+import io
+import json
 import logging
 import os
 import re
 import shutil
+import subprocess
 import sys
 import time
 import zipfile
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from datetime import datetime
-from pathlib import Path
 
-# log = logging.getLogger(__name__)
+# Optional: ISA-L's zlib is a drop-in replacement that deflates 2-3x faster.
+# Point zipfile at it as well, so every member gets the faster compressor.
+try:
+    from isal import isal_zlib as zlib
+    zipfile.zlib = zlib
+except ImportError:
+    import zlib
+
+log = logging.getLogger(__name__)
 VERBOSE = 1
 DEBUG = 1
+# Size of each read when streaming file contents into the archive
+CHUNK_SIZE = 1024 * 1024
+# Buffer size for the archive being written, so members go out in a few large writes
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+# Name of the file, kept beside the archives, recording the inputs of the last backup
+MANIFEST_NAME = '.manifest.json'
+# Files at least this big are streamed into the archive instead of compressed in memory by a worker
+STREAM_THRESHOLD = 64 * 1024 * 1024
+# Deflate level for archive members; level 1 is much faster for only a slightly larger archive
+ZIP_COMPRESSLEVEL = 1
+# Linux ioctl that makes dst share src's extents (a reflink) on btrfs, XFS, etc.
+FICLONE = 0x40049409
+# Leading bytes of formats that are already compressed (gzip, zip, xz, zstd, jpeg, png).
+# These are stored as-is in the archive, since deflating them again gains nothing.
+COMPRESSED_MAGICS = (b'\x1f\x8b', b'PK\x03\x04', b'\xfd7zXZ', b'(\xb5/\xfd', b'\xff\xd8\xff', b'\x89PNG')
 # ========================[ CORE UTILITY FUNCTIONS ]======================== #
 
-def install_pkg(package):
-    try:
-        import pip
-        pip.main(['install', package])
-    except ImportError:
-        print("[-] Unable to use pip to install package")
-        sys.exit(1)
+# Imports with exception handling; colorama is installed on first run by install_colorama()
+try:
+    from colorama import init, Fore
+except ImportError:
+    # Colors are only cosmetic, so fall back to no-op stand-ins
+    def init(*args, **kwargs):
+        return
 
+    class Fore(object):
+        GREEN = RED = YELLOW = WHITE = CYAN = RESET = ''
 
-# Imports with exception handling
-try: from colorama import init, Fore
-except ImportError: install_pkg('colorama')
-try: from colorama import init, Fore
-except ImportError:
-    print("[ERROR] Unable to locate or install pip package 'colorama'")
-    sys.exit(1)
+# Optional: on Windows, let shutil copies go through CopyFileW (server-side copy on SMB shares)
+if sys.platform == 'win32':
+    try:
+        import speedcopy
+        speedcopy.patch_copyfile()
+    except ImportError:
+        pass
 
 
 def create_file(path):
@@ -117,6 +149,24 @@ def create_file(path):
         return True
 
 
+def install_colorama():
+    """
+    Install colorama if it's missing and swap it in for the no-op stand-ins.
+
+    Only called from __main__, so process-pool workers re-importing this module never run pip.
+    """
+    global init, Fore
+    if importlib.util.find_spec('colorama') is not None:
+        return
+    try:
+        subprocess.check_call([sys.executable, '-m', 'pip', 'install', '--quiet', 'colorama'])
+        importlib.invalidate_caches()
+        from colorama import init, Fore
+    except (OSError, subprocess.CalledProcessError, ImportError):
+        print("[WARN] Unable to install pip package 'colorama', continuing without colors")
+    return
+
+
 def check_python_binary():
     # pythonw bug fix to send print() and sys.stdout()
     # calls to be ignored to avoid silent fails.
@@ -129,7 +179,7 @@ def check_python_binary():
 def banner():
     # TODO: Adjust this to size according to terminal width
     line = '=' * 80
-    try:
+    if Fore.RESET:
         init()
         border = Fore.GREEN + "===============================================================================================" + Fore.RESET
         # ASCII Art Generator: http://patorjk.com/software/taag/#p=display&f=Graffiti&t=Type%20Something%20
@@ -142,7 +192,8 @@ def banner():
        \/          \/      \/                 \/          \/      \/     \/     \/     |__|
                                 v {0}\n""".format(__version__)
 
-    except ImportError:
+    else:
+        # Fore is the no-op stand-in, so colorama isn't available
         border = line
         banner_msg = "Windows Backup Assist -- You should 'pip install colorama' for some flair!"
         banner_msg += "\t\t\t\tv {0}".format(__version__)
@@ -162,18 +213,26 @@ class ProgressBar(object):
         self.message = message
         self.progress_symbol = progress_symbol
         self.empty_symbol = empty_symbol
+        # Pre-build full-width bars once; each update just slices the portion it needs
+        self._filled = progress_symbol * self.width
+        self._empty = empty_symbol * self.width
 
     def update(self, progress):
         total_blocks = self.width
         filled_blocks = int(round(progress / (100 / float(total_blocks)) ))
         empty_blocks = total_blocks - filled_blocks
 
-        progress_bar = Fore.CYAN + self.progress_symbol * filled_blocks + self.empty_symbol * empty_blocks
+        progress_bar = (self._filled[:filled_blocks * len(self.progress_symbol)] +
+                        self._empty[:empty_blocks * len(self.empty_symbol)])
 
         if not self.message:
             self.message = u''
 
-        progress_message = u'\r{0} {1} {2}{3}%'.format(self.message, progress_bar, Fore.RESET, progress)
+        # Only color the bar when writing to a console, not to a redirected file
+        if sys.stdout.isatty():
+            progress_message = u'\r{0} {1}{2} {3}{4}%'.format(self.message, Fore.CYAN, progress_bar, Fore.RESET, progress)
+        else:
+            progress_message = u'\r{0} {1} {2}%'.format(self.message, progress_bar, progress)
 
         sys.stdout.write(progress_message)
         sys.stdout.flush()
@@ -183,6 +242,43 @@ class ProgressBar(object):
         self.update(progress)
 
 
+@functools.lru_cache(maxsize=None)
+def _get_excludes():
+    """
+    Transform the excludes glob patterns into a single compiled regex match function.
+
+    This is built lazily, and only once, because LIST_EXCLUDES comes from settings.py,
+    which isn't imported until __main__ runs.
+    """
+    return re.compile(r'|'.join([fnmatch.translate(x) for x in LIST_EXCLUDES]) or r'$.').match
+
+
+def _scan_tree(path, excludes):
+    """
+    Recursively yield the paths of all files beneath a directory, skipping any
+    file or directory whose name or full path matches the excludes pattern.
+
+    :param path: Directory to walk.
+    :param excludes: A compiled regex match function for excluded names.
+    """
+    try:
+        it = os.scandir(path)
+    except OSError as e:
+        # Unreadable (e.g. ACL-locked) folders are skipped, like os.walk does, not fatal
+        log.warning("Skipping directory that can't be read: %s (%s)", path, e)
+        return
+    with it:
+        for entry in it:
+            # Bare names ('LiveContent') match the entry name; path-style globs
+            # ('*\\Temp\\*') match the full path, as they did with os.walk
+            if excludes(entry.name) or excludes(entry.path):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                yield from _scan_tree(entry.path, excludes)
+            elif entry.is_file():
+                yield entry.path
+
+
 def create_input_list(input_list):
     """
     Receive an input list and clean up files and directories to build a clean list of files w/o any directory entries.
@@ -194,23 +290,32 @@ def create_input_list(input_list):
     # Enumerate the input file list and build a proper input list of files
     verified_list = []
 
-    # Transform excludes glob patterns to regular expressions
-    excludes = r'|'.join([fnmatch.translate(x) for x in LIST_EXCLUDES]) or r'$.'
+    excludes = _get_excludes()
+
+    # Where several inputs share a parent directory, classify them all from one scandir
+    # of that parent instead of a stat per item. Anything not found falls back to isdir().
+    by_parent = defaultdict(list)
+    for item in input_list:
+        parent, leaf = os.path.split(item)
+        by_parent[parent].append((leaf, item))
+    entries = {}
+    for parent, leaves in by_parent.items():
+        if len(leaves) < 2:
+            continue
+        try:
+            with os.scandir(parent or os.curdir) as it:
+                listing = {e.name: e for e in it}
+        except OSError:
+            continue
+        for leaf, item in leaves:
+            entries[item] = listing.get(leaf)
 
     for item in input_list:
         # Check if input 'file' is a directory or file
-        if os.path.isdir(item):
-            for root, dirs, filenames in os.walk(item):
-                # Exclude dirs we don't want before processing the walk
-                dirs[:] = [os.path.join(root, d) for d in dirs]
-                dirs[:] = [d for d in dirs if not re.match(excludes, d)]
-                # exclude from files iter
-                filenames = [os.path.join(root, f) for f in filenames]
-                filenames = [f for f in filenames if not re.match(excludes, f)]
-                #filenames = [f for f in filenames if re.match(includes, f)]
-
-                for f in filenames:
-                    verified_list.append(os.path.join(root, f))
+        entry = entries.get(item)
+        is_dir = entry.is_dir() if entry is not None else os.path.isdir(item)
+        if is_dir:
+            verified_list.extend(_scan_tree(item, excludes))
         else:
             verified_list.append(item)
 
@@ -221,13 +326,142 @@ def create_input_list(input_list):
     return verified_list
 
 
+def _is_precompressed(header):
+    """
+    Sniff the first bytes of a file to see if it's an already-compressed format.
+
+    :param header: The first few (at least 8) bytes of the file.
+    :return: True if the file should be stored rather than deflated.
+    """
+    # MP4/MOV and friends carry their 'ftyp' box marker at offset 4
+    return header.startswith(COMPRESSED_MAGICS) or header[4:8] == b'ftyp'
+
+
+def _compress_one(path):
+    """
+    Worker for backup_to_zip: read a file and raw-deflate it into memory.
+
+    Runs in a child process, so it must not rely on anything from settings.py.
+
+    :param path: Full path to the file to compress.
+    :return: Tuple of (path, raw_size, crc32, compressed_bytes, error)
+    """
+    try:
+        crc = 0
+        raw_size = 0
+        buf = io.BytesIO()
+        # Negative wbits produces a raw deflate stream (no zlib header), as required by ZIP
+        compressor = zlib.compressobj(ZIP_COMPRESSLEVEL, zlib.DEFLATED, -15)
+        with open(path, 'rb') as src:
+            for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+                crc = zlib.crc32(chunk, crc)
+                raw_size += len(chunk)
+                buf.write(compressor.compress(chunk))
+        buf.write(compressor.flush())
+        return path, raw_size, crc, buf.getvalue(), None
+    except Exception as e:
+        return path, 0, 0, b'', e
+
+
+def _write_precompressed(z, zinfo, data):
+    """
+    Write already-compressed member data into an open archive without recompressing it.
+    The caller sets compress_type, file_size and CRC on zinfo to describe the data.
+
+    This mirrors what ZipFile.open(zinfo, 'w') does internally, minus the compressor.
+    """
+    zinfo.compress_size = len(data)
+    zinfo.flag_bits = 0x00
+    zip64 = zinfo.file_size > zipfile.ZIP64_LIMIT or zinfo.compress_size > zipfile.ZIP64_LIMIT
+    with z._lock:
+        if z._writing:
+            raise ValueError("Can't write to the ZIP file while another write handle is open")
+        if z._seekable:
+            z.fp.seek(z.start_dir)
+        zinfo.header_offset = z.fp.tell()
+        z._writecheck(zinfo)
+        z._didModify = True
+        z.fp.write(zinfo.FileHeader(zip64))
+        z.fp.write(data)
+        z.filelist.append(zinfo)
+        z.NameToInfo[zinfo.filename] = zinfo
+        z.start_dir = z.fp.tell()
+    return
+
+
+def _stream_to_zip(z, file):
+    """
+    Stream a file into an open archive in one pass, computing the CRC as it compresses.
+
+    The member is always opened with Zip64 extensions, so files past the 2 GiB/4 GiB
+    limits need no second read to size them first.
+    """
+    zinfo = zipfile.ZipInfo.from_file(file)
+    with open(file, 'rb', buffering=0) as src:
+        if _is_precompressed(src.read(8)):
+            zinfo.compress_type = zipfile.ZIP_STORED
+        else:
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+            zinfo._compresslevel = ZIP_COMPRESSLEVEL
+        src.seek(0)
+        # Refill one preallocated buffer rather than allocating a new bytes object per chunk
+        buf = bytearray(CHUNK_SIZE)
+        view = memoryview(buf)
+        with z.open(zinfo, 'w', force_zip64=True) as dst:
+            while True:
+                n = src.readinto(buf)
+                if not n:
+                    break
+                dst.write(view[:n])
+    return
+
+
+def _file_signature(files):
+    """
+    Build a {path: [mtime_ns, size]} map describing the current state of the input files.
+    Files that can't be stat'd are recorded as None.
+    """
+    signature = {}
+    for file in files:
+        try:
+            st = os.stat(file)
+            signature[file] = [st.st_mtime_ns, st.st_size]
+        except OSError:
+            signature[file] = None
+    return signature
+
+
+def _load_manifest(manifest_name):
+    """
+    Load the manifest written by the last successful backup, or an empty dict if there isn't one.
+    """
+    try:
+        with open(manifest_name, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+
 def backup_to_zip(files, dest):
     """
     This function will receive a list of files to backup
     and will copy the files to the pre-defined backup path
 
+    Files are compressed in parallel across a process pool, and the parent
+    process writes the pre-compressed members into the archive in order.
+    Files over STREAM_THRESHOLD, and already-compressed files, are streamed in
+    by the parent afterwards.
+
+    If no input has changed since the last successful run (per MANIFEST_NAME),
+    the previous archive is linked to today's name instead of being rebuilt.
+
     Usage: backup_to_zip(<list of files>, <backup destination folder path>)
     """
+    # Color tags are built once here rather than looked up again for every file
+    ok_tag = Fore.GREEN + "[*]" + Fore.RESET
+    err_tag = Fore.RED + "[ERROR]" + Fore.RESET
+    dbg_tag = Fore.YELLOW + " [DEBUG :: backup_to_zip]" + Fore.RESET
 
     # Check for removable device (defined in defaults.py or settings.py)
     if not os.path.exists(USB_DRIVE):
@@ -235,68 +469,243 @@ def backup_to_zip(files, dest):
             print(Fore.RED + "[WARN]" + Fore.RESET + " USB Drive is not currently connected. Files will be skipped...")
 
     # Build the archive's resulting file name for the backup
-    if dest and os.path.isdir(dest):
-        zip_name = dest + os.sep + BACKUP_FILENAME_PREFIX + time.strftime('%Y%m%d') + '.zip'
-    else:
-        zip_name = BACKUP_PATH + os.sep + BACKUP_FILENAME_PREFIX + time.strftime('%Y%m%d') + '.zip'
-
-    # Open the file as an object for saving to
-    z = zipfile.ZipFile(zip_name, 'w')
-
-    for file in files:
-        # Filter out any patterns we want to skip
-        if os.path.basename(file).startswith('~'):
-            continue
-
-        # Begin prepping and writing to the archive
-        # DST_FILE = os.path.join(dest, os.path.basename(file))
+    zip_dir = dest if dest and os.path.isdir(dest) else BACKUP_PATH
+    zip_name = zip_dir + os.sep + BACKUP_FILENAME_PREFIX + time.strftime('%Y%m%d') + '.zip'
+
+    # Filter out any patterns we want to skip
+    basename = os.path.basename
+    files = [f for f in files if not basename(f).startswith('~')]
+
+    # Skip the whole archive build when nothing has changed since the last good backup
+    manifest_name = os.path.join(zip_dir, MANIFEST_NAME)
+    signature = _file_signature(files)
+    manifest = _load_manifest(manifest_name)
+    prev_zip = os.path.join(zip_dir, manifest['archive']) if manifest.get('archive') else None
+    if manifest.get('files') == signature and prev_zip and os.path.isfile(prev_zip):
+        if os.path.normcase(prev_zip) != os.path.normcase(zip_name) and not os.path.exists(zip_name):
+            try:
+                os.link(prev_zip, zip_name)
+            except OSError:
+                shutil.copy2(prev_zip, zip_name)
+        if VERBOSE:
+            print(f"{ok_tag} No changes since last backup, reusing: {prev_zip}")
+        return
 
+    # Large files are streamed straight into the archive in a single pass, rather than
+    # being buffered whole in a worker's memory. Already-compressed files are streamed too,
+    # since they'd only be stored, and shipping them through a worker saves no CPU.
+    pooled, streamed = [], []
+    if sys.executable.endswith("pythonw.exe"):
+        # No console to spawn workers from under pythonw, so stream every file in serially
+        streamed = files
+    else:
+        for file in files:
+            try:
+                size = os.path.getsize(file)
+                with open(file, 'rb') as f:
+                    header = f.read(8)
+            except OSError:
+                # Let the worker hit and report the error
+                size, header = 0, b''
+            if size >= STREAM_THRESHOLD or _is_precompressed(header):
+                streamed.append(file)
+            else:
+                pooled.append(file)
+
+    # Per-file status and debug lines are batched up together, in order, and written every
+    # 64 files rather than one print each
+    status = []
+    done = 0
+    failed = 0
+
+    def flush_status():
+        if status:
+            sys.stdout.write(''.join(status))
+            sys.stdout.flush()
+            status.clear()
+
+    def record(file, error=None):
+        nonlocal done, failed
+        done += 1
+        if error is not None:
+            failed += 1
         if VERBOSE:
-            print(Fore.GREEN + "[*]" + Fore.RESET + " Copying file: {}".format(str(file)))
-        try:
-            # Copy file; will fail if file is open or locked
-            #shutil.copy2(file, DST_FILE)
-            z.write(file)
+            status.append(f"{ok_tag} Copying file: {file}\n")
+        if error is None:
             if DEBUG:
-                print(Fore.YELLOW + " [DEBUG : backup_to_zip]" + Fore.RESET + " Copied: {}".format(str(file)))
+                status.append(f"{dbg_tag} Copied: {file}\n")
+        elif VERBOSE or DEBUG:
+            status.append(f"{err_tag} Failed copying file: {error}\n")
+        if not done & 63:
+            flush_status()
+
+    # Forget the last backup before touching anything, so if this run dies part-way the
+    # next one rebuilds rather than trusting a manifest that no longer matches the archive
+    if os.path.exists(manifest_name):
+        os.remove(manifest_name)
+
+    def write_pooled(z, file, future):
+        try:
+            file, raw_size, crc, data, error = future.result()
+            if error:
+                # Worker could not read the file; e.g. it is open or locked
+                raise error
+            zinfo = zipfile.ZipInfo.from_file(file)
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+            zinfo.file_size = raw_size
+            zinfo.CRC = crc
+            _write_precompressed(z, zinfo, data)
+            record(file)
         except Exception as e:
-            if VERBOSE or DEBUG:
-                print(Fore.RED + "[ERROR]" + Fore.RESET + " Failed copying file: ", e)
-            pass
-    # Close the zip file when done
-    z.close()
+            # Includes the pool itself failing (BrokenProcessPool), e.g. a worker was killed
+            record(file, e)
+
+    # Build under a temporary name and only move it into place once it's complete,
+    # so a crash part-way never leaves a truncated archive that looks like a real backup.
+    # The replace also leaves alone any older backup today's name was hard-linked to.
+    partial_name = zip_name + '.partial'
+    # Open the file as an object for saving to, behind a large write buffer
+    fh = open(partial_name, 'wb', buffering=WRITE_BUFFER_SIZE)
+    completed = False
+    try:
+        z = zipfile.ZipFile(fh, 'w', zipfile.ZIP_DEFLATED, allowZip64=True, compresslevel=ZIP_COMPRESSLEVEL)
+        try:
+            if pooled:
+                max_workers = min(61, os.cpu_count() or 1)
+                # Only keep a couple of files per worker in flight, so finished members can't pile up
+                # in memory when the archive is written more slowly than they compress (USB, SMB).
+                window = 2 * max_workers
+                with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                    pending = deque()
+                    for file in pooled:
+                        try:
+                            pending.append((file, executor.submit(_compress_one, file)))
+                        except Exception as e:
+                            record(file, e)
+                            continue
+                        if len(pending) >= window:
+                            # Results are written in submission order, so the archive layout is deterministic
+                            write_pooled(z, *pending.popleft())
+                    while pending:
+                        write_pooled(z, *pending.popleft())
+
+            for file in streamed:
+                try:
+                    # Copy file; will fail if file is open or locked
+                    _stream_to_zip(z, file)
+                    record(file)
+                except Exception as e:
+                    record(file, e)
+        finally:
+            flush_status()
+            # Close the zip file when done
+            z.close()
+        completed = True
+    finally:
+        fh.close()
+        if completed:
+            os.replace(partial_name, zip_name)
+        else:
+            try:
+                os.remove(partial_name)
+            except OSError:
+                pass
+
+    # Only remember this run if every file made it in; otherwise retry them all next time
+    if not failed:
+        with open(manifest_name, 'w', encoding='utf-8') as f:
+            json.dump({'archive': os.path.basename(zip_name), 'files': signature}, f)
     return
 
 
-def copy_files_with_progress(files, dst):
+def _clone_or_copy(src, dst, dst_dev=None):
+    """
+    Copy a file, cloning it instead when src and the destination live on the same device.
+
+    A clone (reflink) shares the source's data blocks copy-on-write, so it completes in
+    metadata time while remaining an independent copy. Hard links are deliberately not
+    used, since later edits to the source would then silently rewrite the backup too.
+
+    :param dst_dev: st_dev of the destination directory, if the caller already has it.
+    """
+    # Opening dst for writing would truncate src if they're the same file, so refuse first
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        raise shutil.SameFileError("{!r} and {!r} are the same file".format(src, dst))
+    if sys.platform.startswith('linux') and dst_dev is not None and os.stat(src).st_dev == dst_dev:
+        import fcntl
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            shutil.copystat(src, dst)
+            return dst
+        except OSError as e:
+            # Filesystem can't clone (ext4, tmpfs, ...); fall through to a regular copy
+            if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EXDEV):
+                raise
+    # shutil.copy2 already lets the kernel move the data (sendfile on Linux, CopyFileW
+    # via speedcopy on Windows when installed)
+    return shutil.copy2(src, dst)
+
+
+def copy_files_with_progress(files, dst, progress=None):
     """
     Take a list of files and copies them to a specified destination,
     while showing a progress bar for longer copy operations.
 
-    Usage: copy_files_with_progress(<list of files>, <backup destination path>)
+    Copies run concurrently on a thread pool; the file I/O releases the GIL,
+    so many small files overlap their open/seek latency.
+
+    Usage: copy_files_with_progress(<list of files>, <backup destination path>, [ProgressBar])
     """
+    if progress is None:
+        progress = ProgressBar('# ----[ Copying Files ]----')
     numfiles = len(files)
     numcopied = 0
-    copy_error = []
+    failed = set()
+    debug_lines = []
     print("[DEBUG] Number of files slated for direct copy: {}".format(str(numfiles)))
     if numfiles > 0:
-        for file in files:
-            destfile = os.path.join(dst, os.path.basename(file))
+        max_workers = min(32, (os.cpu_count() or 1) * 4)
+        # Join the destination dir once; each file then only needs its basename appended
+        basename = os.path.basename
+        dst_prefix = os.path.join(dst, '')
+        # Only the Linux clone path needs the destination's device; if it can't be read,
+        # just skip cloning and let each file's copy succeed or fail on its own
+        dst_dev = None
+        if sys.platform.startswith('linux'):
             try:
-                shutil.copy2(file, destfile)
-                numcopied += 1
-                if DEBUG:
-                    print(" [DEBUG :: copy_files_with_progress] Copied: {}".format(str(file)))
-            except Exception as e:
-                copy_error.append(file)
-                files.remove(file)
-                numfiles -= 1
-                if DEBUG:
-                    print(" [DEBUG :: copy_files_with_progress] Copy failed exception, file: {}".format(str(file)))
+                dst_dev = os.stat(dst).st_dev
+            except OSError:
                 pass
-            p.calculate_update(numcopied, numfiles)
+        # Files sharing a basename land on the same destination; as with a serial copy the last
+        # one listed wins, and only it is copied so two threads never write one file at once
+        targets = {}
+        for file in files:
+            targets[dst_prefix + basename(file)] = file
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {pool.submit(_clone_or_copy, file, destfile, dst_dev): file
+                       for destfile, file in targets.items()}
+            for numdone, future in enumerate(as_completed(futures), 1):
+                file = futures[future]
+                try:
+                    future.result()
+                    numcopied += 1
+                    if DEBUG:
+                        debug_lines.append(" [DEBUG :: copy_files_with_progress] Copied: {}\n".format(file))
+                except Exception as e:
+                    failed.add(file)
+                    if DEBUG:
+                        debug_lines.append(" [DEBUG :: copy_files_with_progress] Copy failed exception, "
+                                           "file: {} ({})\n".format(file, e))
+                    pass
+                progress.calculate_update(numdone, len(futures))
 
         print("\n")
+        # Debug lines are held back so they don't break up the progress bar, then written at once
+        sys.stdout.write(''.join(debug_lines))
+        # Drop failures in one pass, preserving the original order of the list
+        files = [f for f in files if f not in failed]
+        copy_error = list(failed)
         for f in copy_error:
             print("# ----[ Error copying file: {}".format(f))
     # Return the list, which may have removed files that were missing
@@ -304,50 +713,97 @@ def copy_files_with_progress(files, dst):
     return files
 
 
+def _hash_file(path):
+    """
+    Return the BLAKE2b digest of a file's contents, read in CHUNK_SIZE blocks.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
 def prune_old_backups(search_path, search_pattern, keep_last=10, do_delete=False):
     """
     Parse the backups directory and remove certain archives to keep
     size consumed down.
 
+    Archives with identical contents count as a single archive towards keep_last,
+    so a week of unchanged backups doesn't push out older ones. Hard links match by
+    inode, and only archives sharing a size with another are hashed (BLAKE2b).
+
     Help/Credit: https://gist.github.com/Amunak/7e2a5f3b1e344287883963689ddc86ef
 
     """
-    # TODO: Process this list of identified backup archives to
-    #       1) identify valid ones based on our naming variable, and
-    #       2) identify the 10 most recent (possibly exclude archives with identical hashes), and delete the rest.
 
     files_to_remove = []
 
     if not os.path.isdir(search_path):
         print(f"[ERR] Search path for pruning old archives is invalid, skipping.")
         return
-    path = Path(search_path)
-    search_files = [f for f in path.glob(search_pattern) if f.is_file()]
-    search_files.sort(reverse=True)
-    counter = 0
+    # DirEntry.is_file() answers from the directory listing, so this is one pass with no per-file stat
+    with os.scandir(search_path) as it:
+        search_files = [e for e in it if e.is_file() and fnmatch.fnmatch(e.name, search_pattern)]
+    search_files.sort(key=lambda e: e.name, reverse=True)
+    dated = []
     for f in search_files:
         try:
-            date = datetime.strptime(f.name, DATES_PATTERN)
+            datetime.strptime(f.name, DATES_PATTERN)
         except ValueError:
             # current file doesn't have a date pattern in it
             continue
-        counter += 1
+        try:
+            # os.stat rather than DirEntry.stat(), which leaves st_ino at 0 on Windows
+            dated.append((f, os.stat(f.path)))
+        except OSError:
+            dated.append((f, None))
+
+    # Only archives sharing a size with a different archive can be duplicates worth hashing.
+    # Hard links (as left by an unchanged run) are the same inode, so they're identical for free.
+    inode_sizes = {(st.st_dev, st.st_ino): st.st_size for f, st in dated if st is not None}
+    sizes = Counter(inode_sizes.values())
+
+    # Group archives with identical contents, so a run of duplicates only uses one keep_last slot.
+    # search_files is newest first, so groups end up ordered by their most recent member.
+    groups = defaultdict(list)
+    inode_keys = {}
+    for f, st in dated:
+        if st is None:
+            # Can't read it to compare, so treat it as unique
+            key = ('path', f.path)
+        elif (st.st_dev, st.st_ino) in inode_keys:
+            key = inode_keys[(st.st_dev, st.st_ino)]
+        else:
+            key = ('inode', st.st_dev, st.st_ino)
+            if sizes[st.st_size] > 1:
+                try:
+                    key = ('hash', _hash_file(f.path))
+                except OSError:
+                    pass
+            inode_keys[(st.st_dev, st.st_ino)] = key
+        groups[key].append(f)
+
+    for counter, members in enumerate(groups.values(), 1):
         if VERBOSE:
-            print(f"[*] File #{counter:,d} '{f.name}': ", end='')
-        # remove = True
+            print(f"[*] File #{counter:,d} '{members[0].name}': ", end='')
         if counter <= keep_last:
             continue
-        else:
+        for f in members:
             if DEBUG:
                 print(f"\n[DBG] Marked excess file: {f.name}")
-            files_to_remove.append(f)
-            if do_delete:
+            files_to_remove.append(f.path)
+
+    if do_delete and files_to_remove:
+        # Deletes are latency-bound (especially on Windows), so overlap them on a thread pool
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            futures = {pool.submit(os.unlink, path): path for path in files_to_remove}
+            for future in as_completed(futures):
                 try:
-                    f.unlink()
+                    future.result()
                 except Exception as e:
                     if DEBUG:
-                        print(f"\n[DBG] Failed to delete file: {f}, Error: {e}")
-                        continue
+                        print(f"\n[DBG] Failed to delete file: {futures[future]}, Error: {e}")
     if files_to_remove:
         print(f"\n[*] {len(files_to_remove):d} files identified (or have been deleted) for pruning")
     return files_to_remove
@@ -366,6 +822,13 @@ def main():
 
     args = parser.parse_args()
 
+    # Only this script's logger is configured; it carries warnings, not per-file chatter
+    if not log.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(" [%(levelname)s] %(message)s"))
+        log.addHandler(handler)
+        log.setLevel(logging.INFO)
+
     # check_python_binary()
 
     if DO_PRUNING:
@@ -379,7 +842,7 @@ def main():
     try:
         # Copy the list of files to destination
         p = ProgressBar('# ----[ Begin Backup & Copy Procedures ]----')
-        my_files = copy_files_with_progress(LIST_COPY_FILES, BACKUP_PATH)
+        my_files = copy_files_with_progress(LIST_COPY_FILES, BACKUP_PATH, p)
     except Exception as e:
         print("[ERR] Failed while copying individual files: {}".format(e))
 
@@ -397,6 +860,7 @@ def main():
 if __name__ == '__main__':
     # See if we are running this with python.exe or pythonw.exe
     check_python_binary()
+    install_colorama()
     print(banner())
 
     # Import settings.py that we don't want stored in version control